@@ -0,0 +1,345 @@
+"""Camera to gantry calibration.
+
+Maps raw (distorted) pixel coordinates from the OAK rgb stream to gantry millimetres.
+
+The full mapping is lens undistortion followed by a pixel -> gantry homography. Rather than
+undistorting every frame, the mapping is evaluated once on a coarse grid of pixel locations at
+startup and only the detected points are transformed, by bilinear interpolation on that grid.
+
+A single point (the blob centroid) is looked up on the coarse grid with plain floats. Arrays of
+points (blob outlines) go through one cv2.remap call on a denser float32 table that is derived
+from the coarse grid at startup.
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+# Spacing, in pixels, between the nodes of the precomputed lookup grid
+DEFAULT_GRID_STEP = 16
+
+# Bump when the layout of the cached calibration file changes
+CACHE_VERSION = 1
+
+# cv2.remap interpolates at 1/32 of a table cell, which on the coarse grid alone costs ~0.15 mm.
+# The remap table subdivides every grid cell this many times per axis to keep that error small.
+REMAP_SUBDIVISIONS = 8
+
+# cv2.remap requires the map to be narrower than SHRT_MAX, so long point arrays are wrapped
+_REMAP_MAX_WIDTH = 16384
+
+
+class GantryCalibration:
+    """Pixel to gantry transform backed by a precomputed lookup grid.
+
+    Args:
+        camera_matrix: 3x3 camera intrinsics matrix.
+        dist_coeffs: OpenCV distortion coefficients (k1, k2, p1, p2[, k3, ...]).
+        homography: 3x3 homography from undistorted pixels to gantry mm.
+        image_size: (width, height) of the image the intrinsics were calibrated for.
+        grid_step: spacing in pixels between lookup grid nodes.
+        grid: optional precomputed lookup grid, as stored in a cached calibration file.
+    """
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray,
+        dist_coeffs: np.ndarray,
+        homography: np.ndarray,
+        image_size: Tuple[int, int],
+        grid_step: int = DEFAULT_GRID_STEP,
+        grid: Optional[np.ndarray] = None,
+    ) -> None:
+        assert grid_step > 0, f"grid_step must be positive. Got: {grid_step}"
+        assert (
+            image_size[0] > 1 and image_size[1] > 1
+        ), f"image_size must be larger than 1x1. Got: {image_size}"
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self.homography = np.asarray(homography, dtype=np.float64).reshape(3, 3)
+        self.image_size = (int(image_size[0]), int(image_size[1]))
+        self.grid_step = int(grid_step)
+
+        # Number of grid nodes along x and y, covering the last pixel row / column
+        self.grid_cols = -(-(self.image_size[0] - 1) // self.grid_step) + 1
+        self.grid_rows = -(-(self.image_size[1] - 1) // self.grid_step) + 1
+
+        if grid is None:
+            grid = self._compute_grid()
+        grid = np.asarray(grid, dtype=np.float64)
+        assert grid.shape == (
+            self.grid_rows,
+            self.grid_cols,
+            2,
+        ), f"grid shape mismatch. Got: {grid.shape}"
+        self.grid = grid
+
+        # Per cell bilinear coefficients (v00, v10 - v00, v01 - v00, v11 - v10 - v01 + v00) as
+        # plain python floats, so a scalar lookup is v = a + fx * (b + d * fy) + c * fy with no
+        # numpy call overhead
+        v00 = grid[:-1, :-1]
+        v10 = grid[:-1, 1:]
+        v01 = grid[1:, :-1]
+        v11 = grid[1:, 1:]
+        coeffs = np.stack([v00, v10 - v00, v01 - v00, v11 - v10 - v01 + v00], axis=2)
+        self._coeffs_list = coeffs.tolist()
+        self._inv_step = 1.0 / self.grid_step
+
+        # Dense table for transform_points, with its first and last nodes exactly on the image
+        # border so that cv2.BORDER_REPLICATE clamps like the scalar lookup does. Bilinear
+        # interpolation on the grid is separable, so the table is one matrix product per axis.
+        remap_step = max(1, self.grid_step // REMAP_SUBDIVISIONS)
+        remap_cols = -(-(self.image_size[0] - 1) // remap_step) + 1
+        remap_rows = -(-(self.image_size[1] - 1) // remap_step) + 1
+        weights_x = self._interpolation_weights(
+            self.image_size[0], remap_cols, self.grid_cols
+        )
+        weights_y = self._interpolation_weights(
+            self.image_size[1], remap_rows, self.grid_rows
+        )
+        rows = (weights_y @ grid.reshape(self.grid_rows, -1)).reshape(
+            remap_rows, self.grid_cols, 2
+        )
+        self._remap_table = (weights_x @ rows).astype(np.float32)
+        self._remap_scale = np.array(
+            [
+                (remap_cols - 1) / (self.image_size[0] - 1),
+                (remap_rows - 1) / (self.image_size[1] - 1),
+            ],
+            dtype=np.float32,
+        )
+
+    def _interpolation_weights(
+        self, length: int, num_nodes: int, grid_nodes: int
+    ) -> np.ndarray:
+        """Linear interpolation weights from the grid nodes to `num_nodes` evenly spaced
+        positions spanning [0, length - 1].
+
+        Returns:
+            An array of shape (num_nodes, grid_nodes).
+        """
+        g = np.linspace(0.0, length - 1, num_nodes) * self._inv_step
+        cell = np.minimum(g.astype(np.intp), grid_nodes - 2)
+        frac = g - cell
+        rows = np.arange(num_nodes)
+        weights = np.zeros((num_nodes, grid_nodes))
+        weights[rows, cell] = 1.0 - frac
+        weights[rows, cell + 1] = frac
+        return weights
+
+    def _compute_grid(self) -> np.ndarray:
+        """Evaluates the exact transform at every lookup grid node."""
+        xs = np.arange(self.grid_cols, dtype=np.float64) * self.grid_step
+        ys = np.arange(self.grid_rows, dtype=np.float64) * self.grid_step
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        nodes = np.stack([grid_x.ravel(), grid_y.ravel()], axis=-1)
+        return self.transform_points_exact(nodes).reshape(
+            self.grid_rows, self.grid_cols, 2
+        )
+
+    def transform_points_exact(self, points: np.ndarray) -> np.ndarray:
+        """Transforms raw pixel points to gantry mm with cv2.undistortPoints and the homography.
+
+        Args:
+            points: array of shape (N, 2) of raw pixel (x, y) coordinates.
+
+        Returns:
+            An array of shape (N, 2) of gantry (x, y) coordinates in mm.
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        undistorted = cv2.undistortPoints(
+            pts, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix
+        )
+        return cv2.perspectiveTransform(undistorted, self.homography).reshape(-1, 2)
+
+    def transform_points(self, points: np.ndarray) -> np.ndarray:
+        """Transforms raw pixel points to gantry mm with a single cv2.remap on the dense table.
+
+        Points outside the image are clamped to its border.
+
+        Args:
+            points: array of shape (N, 2) of raw pixel (x, y) coordinates, e.g. blob contour points.
+
+        Returns:
+            An array of shape (N, 2) of gantry (x, y) coordinates in mm.
+        """
+        pts = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        num_points = len(pts)
+        if num_points == 0:
+            return np.empty((0, 2), dtype=np.float64)
+
+        if num_points < _REMAP_MAX_WIDTH:
+            map_xy = (pts * self._remap_scale).reshape(1, -1, 2)
+        else:
+            rows = -(-num_points // _REMAP_MAX_WIDTH)
+            map_xy = np.zeros((rows * _REMAP_MAX_WIDTH, 2), dtype=np.float32)
+            np.multiply(pts, self._remap_scale, out=map_xy[:num_points])
+            map_xy = map_xy.reshape(rows, _REMAP_MAX_WIDTH, 2)
+
+        out = cv2.remap(
+            self._remap_table,
+            map_xy,
+            None,
+            cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
+        return out.reshape(-1, 2)[:num_points].astype(np.float64)
+
+    def transform_point(self, x: float, y: float) -> Tuple[float, float]:
+        """Transforms a single raw pixel point, e.g. a blob centroid, to gantry mm.
+
+        Bilinear lookup on the coarse grid done on plain floats, which for one point is cheaper
+        than any numpy or OpenCV call.
+        """
+        gx = min(max(float(x), 0.0), self.image_size[0] - 1) * self._inv_step
+        gy = min(max(float(y), 0.0), self.image_size[1] - 1) * self._inv_step
+        i = min(int(gx), self.grid_cols - 2)
+        j = min(int(gy), self.grid_rows - 2)
+        fx = gx - i
+        fy = gy - j
+
+        (ax, ay), (bx, by), (cx, cy), (dx, dy) = self._coeffs_list[j][i]
+        return ax + fx * (bx + dx * fy) + cx * fy, ay + fx * (by + dy * fy) + cy * fy
+
+
+def load_calibration(
+    path: str, grid_step: int = DEFAULT_GRID_STEP
+) -> GantryCalibration:
+    """Loads a calibration from a .npz file.
+
+    The file must contain `camera_matrix`, `dist_coeffs`, `homography` and `image_size`. If it was
+    written by `save_calibration` with the same grid step, the cached lookup grid is reused instead
+    of being recomputed.
+
+    Args:
+        path: path to the .npz calibration file.
+        grid_step: spacing in pixels between lookup grid nodes.
+
+    Returns:
+        An instance of a GantryCalibration.
+    """
+    with np.load(path) as data:
+        grid = None
+        if (
+            "grid" in data
+            and "cache_version" in data
+            and int(data["cache_version"]) == CACHE_VERSION
+            and int(data["grid_step"]) == grid_step
+        ):
+            grid = data["grid"]
+        return GantryCalibration(
+            camera_matrix=data["camera_matrix"],
+            dist_coeffs=data["dist_coeffs"],
+            homography=data["homography"],
+            image_size=tuple(data["image_size"]),
+            grid_step=grid_step,
+            grid=grid,
+        )
+
+
+def save_calibration(path: str, calibration: GantryCalibration) -> None:
+    """Writes a calibration, including its precomputed lookup grid, to a .npz file."""
+    np.savez(
+        path,
+        camera_matrix=calibration.camera_matrix,
+        dist_coeffs=calibration.dist_coeffs,
+        homography=calibration.homography,
+        image_size=np.array(calibration.image_size),
+        grid_step=np.array(calibration.grid_step),
+        grid=calibration.grid,
+        cache_version=np.array(CACHE_VERSION),
+    )
+
+
+def benchmark_calibration(
+    calibration: GantryCalibration,
+    num_points: int = 1000,
+    repeats: int = 100,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Compares the lookup grid against the exact cv2.undistortPoints transform.
+
+    Args:
+        calibration: the calibration to benchmark.
+        num_points: number of random pixel points transformed per call.
+        repeats: number of timed calls for each method.
+        seed: seed for the random pixel points.
+
+    Returns:
+        A dict with the mean and max error in mm of the grid transform, the mean time in seconds
+        per call of the grid and exact transforms on `num_points` points, and the same for a
+        single point (the centroid case).
+    """
+    rng = np.random.default_rng(seed)
+    width, height = calibration.image_size
+    points = rng.uniform((0, 0), (width - 1, height - 1), size=(num_points, 2))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        exact = calibration.transform_points_exact(points)
+    exact_seconds = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        approx = calibration.transform_points(points)
+    grid_seconds = (time.perf_counter() - start) / repeats
+
+    x, y = points[0]
+    point = points[:1]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        calibration.transform_points_exact(point)
+    point_exact_seconds = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        calibration.transform_point(x, y)
+    point_grid_seconds = (time.perf_counter() - start) / repeats
+
+    error = np.linalg.norm(approx - exact, axis=-1)
+    return {
+        "mean_error_mm": float(error.mean()),
+        "max_error_mm": float(error.max()),
+        "grid_seconds": grid_seconds,
+        "exact_seconds": exact_seconds,
+        "point_grid_seconds": point_grid_seconds,
+        "point_exact_seconds": point_exact_seconds,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="oak-color-calibration")
+    parser.add_argument(
+        "calibration", type=str, help="Path to the .npz calibration file."
+    )
+    parser.add_argument(
+        "--grid-step",
+        type=int,
+        default=DEFAULT_GRID_STEP,
+        help="Lookup grid spacing in pixels.",
+    )
+    parser.add_argument(
+        "--num-points", type=int, default=1000, help="Points transformed per call."
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="Write the calibration with its grid to this path.",
+    )
+    args = parser.parse_args()
+
+    calibration = load_calibration(args.calibration, grid_step=args.grid_step)
+    if args.cache is not None:
+        save_calibration(args.cache, calibration)
+    for key, value in benchmark_calibration(
+        calibration, num_points=args.num_points
+    ).items():
+        print(f"{key}: {value:.6g}")
@@ -23,6 +23,11 @@ from farm_ng.canbus.packet import Packet
 GANTRY_ID = 0x12
 # feed rate, x position, y position
 
+# Command ranges that fit GantryRpdo1.format "<BhhBBx": cmd_x is packed as int16 ("h"),
+# cmd_y as an unsigned byte ("B"). Values outside these raise struct.error on encode.
+GANTRY_CMD_X_RANGE = (-(2**15), 2**15 - 1)
+GANTRY_CMD_Y_RANGE = (0, 2**8 - 1)
+
 
 class GantryControlState:
     """State of the Amiga vehicle control unit (VCU)"""
@@ -42,6 +42,8 @@ from farm_ng.service.service_client import ClientConfig
 import turbojpeg
 
 # things I've added #
+from gantry import GANTRY_CMD_X_RANGE
+from gantry import GANTRY_CMD_Y_RANGE
 from gantry import GantryControlState
 from gantry import GantryTpdo1
 from gantry import make_gantry_rpdo1_proto
@@ -49,6 +51,8 @@ from gantry import parse_gantry_tpdo1_proto
 
 import cv2
 import numpy as np
+from OAK_color.calibration import GantryCalibration
+from OAK_color.calibration import load_calibration
 #----#
 
 os.environ["KIVY_NO_ARGS"] = "1"
@@ -69,7 +73,14 @@ from kivy.graphics.texture import Texture  # noqa: E402
 
 
 class CameraColorApp(App):
-    def __init__(self, address: str, camera_port: int, canbus_port: int, stream_every_n: int) -> None:
+    def __init__(
+        self,
+        address: str,
+        camera_port: int,
+        canbus_port: int,
+        stream_every_n: int,
+        calibration_path: Optional[str] = None,
+    ) -> None:
         super().__init__()
         self.address: str = address
         self.camera_port : int = camera_port
@@ -87,8 +98,16 @@ class CameraColorApp(App):
         self.gantry_y = 0
         self.gantry_feed = 1000
         self.gantry_jog = 1
+        # camera target in gantry mm; until one is set the measured position is commanded back
+        self.gantry_cmd_x: Optional[int] = None
+        self.gantry_cmd_y: Optional[int] = None
 
         self.image_decoder = turbojpeg.TurboJPEG()
+
+        # pixel -> gantry mm lookup grid, precomputed once at startup
+        self.calibration: Optional[GantryCalibration] = None
+        if calibration_path is not None:
+            self.calibration = load_calibration(calibration_path)
         
         self.tasks: List[asyncio.Task] = []
 
@@ -270,6 +289,17 @@ class CameraColorApp(App):
                         purple_amount = 400
                         purple_full_mask = cv2.inRange(img, purple_lower, purple_upper)
                         rgb_size = (img.shape[1],img.shape[0])                        
+
+                        # the calibration only holds for the resolution it was made at
+                        if self.calibration is not None and rgb_size != self.calibration.image_size:
+                            print(
+                                f"rgb frame size {rgb_size} does not match calibration size "
+                                f"{self.calibration.image_size}, not commanding the gantry"
+                            )
+                            self.calibration = None
+                            # drop any target set before the mismatch so it isn't driven to forever
+                            self.gantry_cmd_x = None
+                            self.gantry_cmd_y = None
                         
                         #//////////// calculate the middle of all purple, set gantry_x and gantry_y to location of blob center
                         # calculate moments of binary image
@@ -284,6 +314,23 @@ class CameraColorApp(App):
                             # calculate x,y coordinate of center
                             cX = int(M["m10"] / M["m00"])
                             cY = int(M["m01"] / M["m00"])
+
+                            # map only the centroid to gantry mm, instead of undistorting the whole frame
+                            if self.calibration is not None:
+                                gantry_x, gantry_y = self.calibration.transform_point(
+                                    M["m10"] / M["m00"], M["m01"] / M["m00"]
+                                )
+                                cmd_x = int(round(gantry_x))
+                                cmd_y = int(round(gantry_y))
+                                # targets that don't fit the RPDO1 fields would raise in pose_generator
+                                if (
+                                    GANTRY_CMD_X_RANGE[0] <= cmd_x <= GANTRY_CMD_X_RANGE[1]
+                                    and GANTRY_CMD_Y_RANGE[0] <= cmd_y <= GANTRY_CMD_Y_RANGE[1]
+                                ):
+                                    self.gantry_cmd_x = cmd_x
+                                    self.gantry_cmd_y = cmd_y
+                                else:
+                                    print(f"Gantry target ({cmd_x}, {cmd_y}) mm is out of range, ignoring")
                         #////////////
                         
                         
@@ -399,8 +446,8 @@ class CameraColorApp(App):
             msg: canbus_pb2.RawCanbusMessage = make_gantry_rpdo1_proto(
                 state_req = GantryControlState.STATE_AUTO_ACTIVE,
                 cmd_feed = self.gantry_feed,
-                cmd_x = self.gantry_x,
-                cmd_y = self.gantry_y,
+                cmd_x = self.gantry_x if self.gantry_cmd_x is None else self.gantry_cmd_x,
+                cmd_y = self.gantry_y if self.gantry_cmd_y is None else self.gantry_cmd_y,
                 jog = self.gantry_jog
             )
             yield canbus_pb2.SendCanbusMessageRequest(message=msg)
@@ -432,12 +479,20 @@ if __name__ == "__main__":
         default=1, 
         help="Streaming frequency"
     )
+    parser.add_argument(
+        "--calibration",
+        type=str,
+        default=None,
+        help="Path to a .npz camera to gantry calibration file.",
+    )
     args = parser.parse_args()
 
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(
-            CameraColorApp(args.address, args.camera_port, args.canbus_port, args.stream_every_n).app_func()
+            CameraColorApp(
+                args.address, args.camera_port, args.canbus_port, args.stream_every_n, args.calibration
+            ).app_func()
         )
     except asyncio.CancelledError:
         pass
@@ -0,0 +1,124 @@
+"""Tests for the camera to gantry calibration."""
+import numpy as np
+import pytest
+from OAK_color import calibration
+
+IMAGE_SIZE = (640, 480)
+CAMERA_MATRIX = np.array([[500.0, 0.0, 320.0], [0.0, 500.0, 240.0], [0.0, 0.0, 1.0]])
+DIST_COEFFS = np.array([-0.12, 0.03, 0.001, -0.0005, 0.0])
+# ~0.5 mm per pixel, offset so the gantry origin is at the image top left
+HOMOGRAPHY = np.array([[0.5, 0.0, 10.0], [0.0, 0.5, 20.0], [0.0, 0.0, 1.0]])
+
+
+@pytest.fixture
+def calib() -> calibration.GantryCalibration:
+    return calibration.GantryCalibration(
+        CAMERA_MATRIX, DIST_COEFFS, HOMOGRAPHY, IMAGE_SIZE
+    )
+
+
+class TestCalibration:
+    def test_grid_covers_image(self, calib) -> None:
+        assert calib.grid.shape == (calib.grid_rows, calib.grid_cols, 2)
+        assert (calib.grid_cols - 1) * calib.grid_step >= IMAGE_SIZE[0] - 1
+        assert (calib.grid_rows - 1) * calib.grid_step >= IMAGE_SIZE[1] - 1
+
+    def test_no_distortion_is_homography(self) -> None:
+        calib = calibration.GantryCalibration(
+            CAMERA_MATRIX, np.zeros(5), HOMOGRAPHY, IMAGE_SIZE
+        )
+        points = np.array([[0.0, 0.0], [100.5, 37.25], [639.0, 479.0]])
+        expected = points * 0.5 + np.array([10.0, 20.0])
+        # cv2.remap interpolates at 1/32 of a table cell
+        assert np.allclose(calib.transform_points(points), expected, atol=0.05)
+
+    def test_grid_matches_exact(self, calib) -> None:
+        rng = np.random.default_rng(1)
+        points = rng.uniform(
+            (0, 0), (IMAGE_SIZE[0] - 1, IMAGE_SIZE[1] - 1), size=(500, 2)
+        )
+        error = np.linalg.norm(
+            calib.transform_points(points) - calib.transform_points_exact(points),
+            axis=-1,
+        )
+        assert error.max() < 0.1
+
+    def test_transform_point(self, calib) -> None:
+        x, y = calib.transform_point(200.0, 100.0)
+        assert np.allclose(
+            (x, y),
+            calib.transform_points_exact(np.array([[200.0, 100.0]]))[0],
+            atol=0.1,
+        )
+
+    def test_transform_point_matches_transform_points(self, calib) -> None:
+        points = np.array(
+            [[0.0, 0.0], [15.9, 16.1], [333.3, 222.2], [639.0, 479.0], [-5.0, 900.0]]
+        )
+        expected = calib.transform_points(points)
+        for (x, y), (ex, ey) in zip(points, expected):
+            assert np.allclose(calib.transform_point(x, y), (ex, ey), atol=0.05)
+
+    def test_cache_round_trip(self, calib, tmp_path) -> None:
+        path = str(tmp_path / "calibration.npz")
+        calibration.save_calibration(path, calib)
+
+        cached = calibration.load_calibration(path, grid_step=calib.grid_step)
+        assert np.array_equal(cached.grid, calib.grid)
+        assert cached.image_size == IMAGE_SIZE
+
+        regridded = calibration.load_calibration(path, grid_step=8)
+        assert regridded.grid.shape == (regridded.grid_rows, regridded.grid_cols, 2)
+
+    def test_load_bare_file(self, calib, tmp_path) -> None:
+        path = str(tmp_path / "calibration.npz")
+        np.savez(
+            path,
+            camera_matrix=CAMERA_MATRIX,
+            dist_coeffs=DIST_COEFFS,
+            homography=HOMOGRAPHY,
+            image_size=np.array(IMAGE_SIZE),
+        )
+
+        loaded = calibration.load_calibration(path)
+        assert loaded.image_size == IMAGE_SIZE
+        assert np.allclose(loaded.grid, calib.grid)
+
+    @pytest.mark.parametrize(
+        "cache_version,reused",
+        [(calibration.CACHE_VERSION, True), (calibration.CACHE_VERSION - 1, False)],
+    )
+    def test_cache_version(self, calib, tmp_path, cache_version, reused) -> None:
+        # a zero grid makes it visible whether the cached grid was reused or recomputed
+        path = str(tmp_path / "calibration.npz")
+        np.savez(
+            path,
+            camera_matrix=CAMERA_MATRIX,
+            dist_coeffs=DIST_COEFFS,
+            homography=HOMOGRAPHY,
+            image_size=np.array(IMAGE_SIZE),
+            grid_step=np.array(calib.grid_step),
+            grid=np.zeros_like(calib.grid),
+            cache_version=np.array(cache_version),
+        )
+
+        loaded = calibration.load_calibration(path, grid_step=calib.grid_step)
+        if reused:
+            assert not loaded.grid.any()
+        else:
+            assert np.allclose(loaded.grid, calib.grid)
+
+    def test_benchmark(self, calib) -> None:
+        result = calibration.benchmark_calibration(calib, num_points=1000, repeats=50)
+        assert result["max_error_mm"] < 0.1
+        assert result["mean_error_mm"] <= result["max_error_mm"]
+        # the lookup grid only exists to be cheaper than cv2.undistortPoints
+        assert result["grid_seconds"] < result["exact_seconds"]
+        assert result["point_grid_seconds"] < result["point_exact_seconds"]
+
+    @pytest.mark.parametrize("image_size", [(1, 480), (640, 1)])
+    def test_degenerate_image_size(self, image_size) -> None:
+        with pytest.raises(AssertionError):
+            calibration.GantryCalibration(
+                CAMERA_MATRIX, DIST_COEFFS, HOMOGRAPHY, image_size
+            )